@@ -1,19 +1,22 @@
 import asyncio
+import concurrent.futures
+import functools
+import hashlib
 import importlib
-import json
 import re
 import logging
 import os
-import subprocess
 import sys
 import threading
 import time
-import urllib.error
-import urllib.request
-from uuid import uuid4
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import asynccontextmanager
 
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 
 from perplexity_webui_scraper import (
     MODELS,
@@ -27,6 +30,8 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
 log = logging.getLogger("perplexity-sidecar")
+# httpx logs every request at INFO; dashboard token lookups would flood the log.
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 DASHBOARD_URL = os.environ.get("DASHBOARD_URL", "http://dashboard:3000")
 SIDECAR_SECRET = os.environ.get("PERPLEXITY_SIDECAR_SECRET") or os.environ.get(
@@ -34,6 +39,15 @@ SIDECAR_SECRET = os.environ.get("PERPLEXITY_SIDECAR_SECRET") or os.environ.get(
 )
 SESSION_COOKIE_NAME = "__Secure-next-auth.session-token"
 
+# Shared keep-alive pool for sidecar -> dashboard calls. Token lookups happen
+# on every chat completion, so reusing sockets instead of opening a fresh
+# connection per call keeps the dashboard round-trip off the hot path.
+_http_async = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    timeout=10.0,
+    headers={"Authorization": f"Bearer {SIDECAR_SECRET}"},
+)
+
 
 # ---------------------------------------------------------------------------
 # Auto Model Discovery — builds model map from library at startup
@@ -65,6 +79,7 @@ SLUG_ALIASES = {
 }
 
 
+@functools.lru_cache(maxsize=512)
 def _split_model_id(model_id: str) -> tuple[str, str]:
     """Split a namespaced model id into ``(namespace, slug)``.
 
@@ -77,6 +92,7 @@ def _split_model_id(model_id: str) -> tuple[str, str]:
     return "", model_id
 
 
+@functools.lru_cache(maxsize=512)
 def _slug_to_alias(slug: str) -> str:
     """Convert a library slug to our perplexity-prefixed alias.
 
@@ -128,6 +144,26 @@ def discover_models() -> dict[str, dict]:
 
 MODEL_REGISTRY = discover_models()
 log.info("Discovered %d models: %s", len(MODEL_REGISTRY), list(MODEL_REGISTRY.keys()))
+# Listed in the unknown-model error; the registry never changes at runtime.
+_MODEL_NAMES = ", ".join(MODEL_REGISTRY)
+
+# The registry is fixed for the life of the process, so the /v1/models body is
+# serialised once and served as raw bytes. ``created`` is the discovery time.
+_MODELS_CREATED = int(time.time())
+_MODELS_BODY = orjson.dumps(
+    {
+        "object": "list",
+        "data": [
+            {
+                "id": alias,
+                "object": "model",
+                "created": _MODELS_CREATED,
+                "owned_by": "perplexity-pro",
+            }
+            for alias in MODEL_REGISTRY
+        ],
+    }
+)
 
 
 # ---------------------------------------------------------------------------
@@ -159,6 +195,11 @@ def _get_installed_version() -> str:
         return "0.0.0"
 
 
+# Read once: importlib.metadata scans sys.path on every call, and /health is
+# polled continuously. The auto-updater refreshes it after an upgrade.
+_INSTALLED_VERSION = _get_installed_version()
+
+
 # Package name and version-specifier source. The auto-updater MUST resolve the
 # spec against requirements.txt so a runtime upgrade can never escape the pin
 # that was tested at image-build time.
@@ -177,9 +218,12 @@ _REQ_LINE_RE = re.compile(
 )
 
 
+_DIST_NAME_SEP_RE = re.compile(r"[-_.]+")
+
+
 def _normalize_dist_name(name: str) -> str:
     """PEP 503 normalisation: lowercase + collapse runs of ``-_.`` to ``-``."""
-    return re.sub(r"[-_.]+", "-", name).lower()
+    return _DIST_NAME_SEP_RE.sub("-", name).lower()
 
 
 def _read_pinned_spec() -> str:
@@ -226,27 +270,54 @@ def _read_pinned_spec() -> str:
 PINNED_SPEC = _read_pinned_spec()
 
 
-def _trigger_dashboard_sync():
+async def _trigger_dashboard_sync():
     url = f"{DASHBOARD_URL}/api/providers/perplexity-cookie/sync-models"
-    data = json.dumps({}).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=data,
-        headers={
-            "Authorization": f"Bearer {SIDECAR_SECRET}",
-            "Content-Type": "application/json",
-        },
-        method="PUT",
-    )
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            body = json.loads(resp.read().decode("utf-8"))
-            log.info("Dashboard sync result: %s", body)
+        resp = await _http_async.put(url, json={}, timeout=15.0)
+        resp.raise_for_status()
+        log.info("Dashboard sync result: %s", resp.json())
     except Exception as exc:
         log.warning("Dashboard sync failed (will sync on next restart): %s", exc)
 
 
-def _auto_update_loop():
+# PEP 691 JSON simple index: lists file names and versions only, far smaller
+# than /pypi/<name>/json with its per-release metadata.
+PYPI_SIMPLE_URL = f"https://pypi.org/simple/{PACKAGE_NAME}/"
+PYPI_SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+
+
+async def _check_pypi_index(
+    previous: tuple[str | None, tuple[str, ...]] | None,
+) -> tuple[str | None, tuple[str, ...]] | None:
+    """Return ``(etag, versions)`` for PACKAGE_NAME from PyPI.
+
+    Sends ``previous``'s ETag so an unchanged index comes back as a bodyless
+    304, in which case ``previous`` is returned as-is. Returns ``None`` when
+    the index cannot be read (or a custom index is configured) so the caller
+    falls back to always running pip.
+    """
+    if os.environ.get("PIP_INDEX_URL"):
+        return None
+    headers = {"Accept": PYPI_SIMPLE_JSON}
+    if previous is not None and previous[0]:
+        headers["If-None-Match"] = previous[0]
+    try:
+        # Separate client: the shared one carries the dashboard bearer token.
+        async with httpx.AsyncClient(timeout=httpx.Timeout(5.0)) as client:
+            resp = await client.get(PYPI_SIMPLE_URL, headers=headers)
+        if resp.status_code == 304 and previous is not None:
+            return previous
+        resp.raise_for_status()
+        versions = tuple(resp.json().get("versions") or ())
+    except (httpx.HTTPError, ValueError) as exc:
+        log.debug("PyPI index check failed: %s", exc)
+        return None
+    if not versions:
+        return None
+    return resp.headers.get("etag"), versions
+
+
+async def _auto_update_loop():
     """Periodically reapply the pinned spec; restart only when the installed
     version actually changed.
 
@@ -254,42 +325,62 @@ def _auto_update_loop():
     upstream release outside the pin (e.g. 2.x while pinned to ``<2``) is a
     no-op here and does not trigger a restart loop.
     """
+    global _INSTALLED_VERSION
+
+    # Index state seen by the last successful pip run. pip is only spawned
+    # again once PyPI lists a different set of versions.
+    last_index: tuple[str | None, tuple[str, ...]] | None = None
+
     while True:
-        time.sleep(UPDATE_CHECK_INTERVAL)
+        await asyncio.sleep(UPDATE_CHECK_INTERVAL)
         try:
-            installed_before = _get_installed_version()
+            index = await _check_pypi_index(last_index)
+            if (
+                index is not None
+                and last_index is not None
+                and index[1] == last_index[1]
+            ):
+                log.debug("No new %s release on PyPI; skipping pip", PACKAGE_NAME)
+                continue
+
+            installed_before = _INSTALLED_VERSION
 
             log.debug("Reapplying pin %r (installed: %s)", PINNED_SPEC, installed_before)
-            result = subprocess.run(
-                [
-                    sys.executable,
-                    "-m",
-                    "pip",
-                    "install",
-                    "--no-cache-dir",
-                    "--quiet",
-                    "--upgrade",
-                    PINNED_SPEC,
-                ],
-                capture_output=True,
-                text=True,
-                timeout=120,
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--no-cache-dir",
+                "--quiet",
+                "--upgrade",
+                PINNED_SPEC,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
             )
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise TimeoutError("pip install timed out after 120s") from None
 
-            if result.returncode != 0:
+            if proc.returncode != 0:
                 log.error(
                     "pip install %s failed (rc=%d): %s",
                     PINNED_SPEC,
-                    result.returncode,
-                    (result.stderr or "").strip(),
+                    proc.returncode,
+                    stderr.decode(errors="replace").strip(),
                 )
                 continue
+            last_index = index
 
             # importlib.metadata caches dist info per-call, but the loader
             # itself caches the path entries. Invalidate so the post-install
             # version read sees freshly written .dist-info files.
             importlib.invalidate_caches()
             installed_after = _get_installed_version()
+            _INSTALLED_VERSION = installed_after
 
             if installed_after == installed_before:
                 log.debug("Library already at pinned ceiling (%s)", installed_after)
@@ -302,64 +393,109 @@ def _auto_update_loop():
                 installed_before,
                 installed_after,
             )
-            _trigger_dashboard_sync()
+            await _trigger_dashboard_sync()
             log.info("Exiting for restart...")
             os._exit(0)
         except Exception as exc:
             log.error("Auto-update check failed: %s", exc)
 
 
-if _AUTO_UPDATE_ENABLED:
-    threading.Thread(target=_auto_update_loop, daemon=True).start()
-    log.info("Auto-update checker started (interval: %ds)", UPDATE_CHECK_INTERVAL)
-else:
-    log.info(
-        "Auto-update disabled (PERPLEXITY_SIDECAR_AUTO_UPDATE=%r, UPDATE_CHECK_INTERVAL=%s)",
-        os.environ.get("PERPLEXITY_SIDECAR_AUTO_UPDATE"),
-        UPDATE_CHECK_INTERVAL,
-    )
-
-
-def _startup_sync():
-    time.sleep(10)
+async def _startup_sync():
+    await asyncio.sleep(10)
     log.info("Running startup model sync...")
-    _trigger_dashboard_sync()
-
-
-threading.Thread(target=_startup_sync, daemon=True).start()
+    await _trigger_dashboard_sync()
 
 
 # ---------------------------------------------------------------------------
 # Cookie / session management
 # ---------------------------------------------------------------------------
 
-_client: Perplexity | None = None
-_client_token_hash: str = ""
+# Warm Perplexity clients keyed by token digest, most recently used last.
+# Keeping a few around means a cookie that rotates back (e.g. alternating
+# accounts) reuses its curl session instead of rebuilding it, and a rotation
+# no longer closes the client under streams that are still running on it.
+MAX_CLIENTS = 4
+_clients: "OrderedDict[str, Perplexity]" = OrderedDict()
+
+# The dashboard cookie rotates on the order of hours, so a short-lived cache
+# turns the per-request dashboard round-trip into a dict lookup. Invalidated
+# whenever Perplexity rejects a request so a fresh cookie is picked up at once.
+DASHBOARD_TOKEN_TTL = 30.0
+_token_cache: dict = {"value": None, "expires": 0.0}
+# In-flight refresh shared by every request that finds the cache expired, so
+# a burst of requests costs one dashboard call rather than one each.
+_token_refresh: asyncio.Task | None = None
 
 
-def _fetch_session_token_from_dashboard() -> str | None:
+async def _fetch_session_token_from_dashboard() -> str | None:
+    """Return the session cookie stored in the dashboard, ``None`` if unset.
+
+    Transport and decoding errors propagate so callers can tell "no cookie
+    configured" apart from "dashboard unreachable".
+    """
     url = f"{DASHBOARD_URL}/api/providers/perplexity-cookie/current"
-    req = urllib.request.Request(
-        url,
-        headers={"Authorization": f"Bearer {SIDECAR_SECRET}"},
-    )
+    resp = await _http_async.get(url)
+    resp.raise_for_status()
+    data = orjson.loads(resp.content)
+    cookies = data.get("cookies")
+    if not cookies:
+        return None
+    token = cookies.get(SESSION_COOKIE_NAME) or cookies.get("next-auth.session-token")
+    return token or None
+
+
+async def _refresh_dashboard_token() -> str | None:
+    global _token_refresh
+
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            cookies = data.get("cookies")
-            if not cookies:
-                return None
-            token = cookies.get(SESSION_COOKIE_NAME) or cookies.get(
-                "next-auth.session-token"
-            )
-            return token or None
-    except (urllib.error.URLError, json.JSONDecodeError, OSError) as exc:
-        log.debug("Dashboard cookie fetch failed: %s", exc)
-    return None
+        try:
+            token = await _fetch_session_token_from_dashboard()
+        except (httpx.HTTPError, orjson.JSONDecodeError) as exc:
+            # Keep the last known cookie through a dashboard hiccup instead of
+            # flapping to the env token, which would tear down the warm
+            # upstream connection twice.
+            log.debug("Dashboard cookie fetch failed: %s", exc)
+            token = _token_cache["value"]
+        _token_cache["value"] = token
+        _token_cache["expires"] = time.monotonic() + DASHBOARD_TOKEN_TTL
+        return token
+    finally:
+        _token_refresh = None
+
+
+def _start_token_refresh() -> asyncio.Task:
+    global _token_refresh
+
+    if _token_refresh is None:
+        _token_refresh = asyncio.create_task(_refresh_dashboard_token())
+    return _token_refresh
 
 
-def _get_session_token() -> str:
-    token = _fetch_session_token_from_dashboard()
+async def _get_dashboard_token() -> str | None:
+    if time.monotonic() < _token_cache["expires"]:
+        return _token_cache["value"]
+    # Shielded so a waiter whose client disconnects does not cancel the
+    # refresh the other waiters are sharing.
+    return await asyncio.shield(_start_token_refresh())
+
+
+def _peek_dashboard_token() -> str | None:
+    """Return the cached dashboard token without waiting on the dashboard.
+
+    A stale cache kicks off a background refresh for the next caller. Used by
+    /health so liveness probes never depend on dashboard latency.
+    """
+    if time.monotonic() >= _token_cache["expires"]:
+        _start_token_refresh()
+    return _token_cache["value"]
+
+
+def _invalidate_dashboard_token() -> None:
+    _token_cache["expires"] = 0.0
+
+
+async def _get_session_token() -> str:
+    token = await _get_dashboard_token()
     if token:
         return token
 
@@ -370,13 +506,13 @@ def _get_session_token() -> str:
     raw = os.environ.get("PERPLEXITY_COOKIES", "").strip()
     if raw:
         try:
-            cookies = json.loads(raw)
+            cookies = orjson.loads(raw)
             t = cookies.get(SESSION_COOKIE_NAME) or cookies.get(
                 "next-auth.session-token"
             )
             if t:
                 return t
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
 
     raise HTTPException(
@@ -385,23 +521,34 @@ def _get_session_token() -> str:
     )
 
 
-def get_client() -> Perplexity:
-    global _client, _client_token_hash
+@functools.lru_cache(maxsize=8)
+def _token_digest(token: str) -> str:
+    # Digest of the full token: a prefix/suffix sample can match across
+    # rotated tokens and keep a stale client alive. Memoized because the same
+    # cached token is presented on every request between rotations.
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
 
-    token = _get_session_token()
-    token_hash = token[:16] + token[-16:]
 
-    if _client is None or token_hash != _client_token_hash:
-        if _client is not None:
-            try:
-                _client.close()
-            except Exception:
-                pass
-        log.info("Initialising Perplexity client (token changed or first init)")
-        _client = Perplexity(session_token=token)
-        _client_token_hash = token_hash
+async def get_client() -> Perplexity:
+    token = await _get_session_token()
+    token_hash = _token_digest(token)
+
+    client = _clients.get(token_hash)
+    if client is not None:
+        _clients.move_to_end(token_hash)
+        return client
+
+    log.info("Initialising Perplexity client (token changed or first init)")
+    client = Perplexity(session_token=token)
+    _clients[token_hash] = client
+    while len(_clients) > MAX_CLIENTS:
+        _, stale = _clients.popitem(last=False)
+        try:
+            stale.close()
+        except Exception:
+            pass
 
-    return _client
+    return client
 
 
 # ---------------------------------------------------------------------------
@@ -409,19 +556,30 @@ def get_client() -> Perplexity:
 # ---------------------------------------------------------------------------
 
 
+def _text_blocks(content: list) -> Iterator[str]:
+    for block in content:
+        if isinstance(block, dict):
+            if block.get("type") == "text":
+                yield block.get("text", "")
+        elif isinstance(block, str):
+            yield block
+
+
 def messages_to_query(messages: list[dict]) -> str:
+    # Fast path: a conversation of plain-string user turns needs no role
+    # prefixes or block flattening, so join the contents in one pass.
+    if all(
+        msg.get("role", "user") == "user" and isinstance(msg.get("content"), str)
+        for msg in messages
+    ):
+        return "\n\n".join(msg["content"] for msg in messages)
+
     parts: list[str] = []
     for msg in messages:
         role = msg.get("role", "user")
         content = msg.get("content", "")
         if isinstance(content, list):
-            text_parts = []
-            for block in content:
-                if isinstance(block, dict) and block.get("type") == "text":
-                    text_parts.append(block.get("text", ""))
-                elif isinstance(block, str):
-                    text_parts.append(block)
-            content = "\n".join(text_parts)
+            content = "\n".join(_text_blocks(content))
         if role == "system":
             parts.append(f"[System Instructions]\n{content}\n")
         elif role == "assistant":
@@ -431,31 +589,62 @@ def messages_to_query(messages: list[dict]) -> str:
     return "\n\n".join(parts)
 
 
+# ---------------------------------------------------------------------------
+# Worker pool — perplexity-webui-scraper is blocking, so upstream calls run on
+# a bounded pool instead of blocking the event loop or spawning a thread per
+# request. Each in-flight request (streaming or not) holds one slot; requests
+# beyond MAX_STREAMS are rejected with 503 rather than queued behind them.
+# ---------------------------------------------------------------------------
+
+MAX_STREAMS = int(os.environ.get("SIDECAR_MAX_STREAMS", "32"))
+_worker_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_STREAMS, thread_name_prefix="pplx-worker"
+)
+_worker_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
 # ---------------------------------------------------------------------------
 # FastAPI app
 # ---------------------------------------------------------------------------
 
-app = FastAPI(title="Perplexity Pro Sidecar", version="2.2.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Background jobs run as tasks on the server loop rather than dedicated
+    # threads that mostly sleep; they are cancelled cleanly on shutdown.
+    tasks = [asyncio.create_task(_startup_sync())]
+    # Warm the dashboard token so the first /health probe reports the real
+    # state instead of "degraded" from the empty cache.
+    _start_token_refresh()
+    if _AUTO_UPDATE_ENABLED:
+        tasks.append(asyncio.create_task(_auto_update_loop()))
+        log.info("Auto-update checker started (interval: %ds)", UPDATE_CHECK_INTERVAL)
+    else:
+        log.info(
+            "Auto-update disabled (PERPLEXITY_SIDECAR_AUTO_UPDATE=%r, UPDATE_CHECK_INTERVAL=%s)",
+            os.environ.get("PERPLEXITY_SIDECAR_AUTO_UPDATE"),
+            UPDATE_CHECK_INTERVAL,
+        )
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+    _worker_pool.shutdown(wait=False, cancel_futures=True)
+    for client in _clients.values():
+        try:
+            client.close()
+        except Exception:
+            pass
+    _clients.clear()
+    await _http_async.aclose()
+
+
+app = FastAPI(title="Perplexity Pro Sidecar", version="2.2.0", lifespan=lifespan)
 
 
 @app.get("/v1/models")
 async def list_models():
-    now = int(time.time())
-    seen = set()
-    models = []
-    for alias, info in MODEL_REGISTRY.items():
-        if alias in seen:
-            continue
-        seen.add(alias)
-        models.append(
-            {
-                "id": alias,
-                "object": "model",
-                "created": now,
-                "owned_by": f"perplexity-pro",
-            }
-        )
-    return {"object": "list", "data": models}
+    return Response(content=_MODELS_BODY, media_type="application/json")
 
 
 @app.post("/v1/chat/completions")
@@ -476,36 +665,40 @@ async def chat_completions(request: Request):
     if entry is None:
         raise HTTPException(
             status_code=400,
-            detail=f"Unknown model: {model_name}. Available: {list(MODEL_REGISTRY.keys())}",
+            detail=f"Unknown model: {model_name}. Available: {_MODEL_NAMES}",
         )
 
     model_id = entry["model_id"]
     query = messages_to_query(messages)
-    request_id = f"chatcmpl-{uuid4().hex[:24]}"
+    request_id = f"chatcmpl-{os.urandom(12).hex()}"
     created = int(time.time())
 
-    client = get_client()
+    client = await get_client()
     config = ConversationConfig(citation_mode="clean")
     conversation = client.create_conversation(config)
 
+    if not _worker_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503, detail="Too many concurrent requests, retry later"
+        )
+
     if stream:
+        # Start upstream work here rather than inside the generator: the
+        # producer owns the slot and must run even if the client disconnects
+        # before the first chunk is pulled.
+        queue = _start_producer(conversation, query, model_id)
         return StreamingResponse(
-            _stream_response(
-                conversation, query, model_id, model_name, request_id, created
-            ),
+            _stream_response(queue, model_name, request_id, created),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
+            headers=_SSE_HEADERS,
         )
 
     try:
-        conversation.ask(query, model=model_id, stream=False)
-        answer = conversation.answer or ""
+        answer = await asyncio.get_running_loop().run_in_executor(
+            _worker_pool, _ask_blocking, conversation, query, model_id
+        )
 
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "id": request_id,
                 "object": "chat.completion",
@@ -527,105 +720,225 @@ async def chat_completions(request: Request):
         )
     except PerplexityError as exc:
         log.error("Perplexity error: %s", exc)
+        _invalidate_dashboard_token()
         raise HTTPException(status_code=502, detail=str(exc))
     except Exception as exc:
         log.exception("Request failed")
         raise HTTPException(status_code=502, detail=str(exc))
 
 
-async def _stream_response(
-    conversation,
-    query: str,
-    model_id: str,
-    model_name: str,
-    request_id: str,
-    created: int,
-):
-    queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+def _ask_blocking(conversation, query: str, model_id: str) -> str:
+    """Run a non-streaming ask on the worker pool and release the slot."""
+    try:
+        conversation.ask(query, model=model_id, stream=False)
+        return conversation.answer or ""
+    finally:
+        _worker_slots.release()
+
+
+# Per-stream backlog (in queued deltas) before the producer blocks, and how
+# long it waits on a stalled consumer before giving up on the stream.
+STREAM_QUEUE_SIZE = 64
+STREAM_PUT_TIMEOUT = 30.0
+# Upper bound (in characters) for deltas merged into a single SSE frame.
+STREAM_COALESCE_MAX = 4096
+# Seconds without upstream output before an SSE comment is sent, so proxies
+# and clients don't drop a connection while deep research is still thinking.
+STREAM_PING_INTERVAL = 15.0
+_SSE_PING = b": ping\n\n"
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+class _StreamAbandoned(Exception):
+    """The SSE consumer stopped draining the queue (client gone or stalled)."""
+
+
+class _DeltaQueue(asyncio.Queue):
+    """Queue fed from a worker thread, bounded on the producer side.
+
+    The producer takes a credit before each put and hands the item to the
+    loop with a one-way ``call_soon_threadsafe``; the credit is returned when
+    the consumer takes the item. Unlike ``run_coroutine_threadsafe`` this does
+    not make the producer wait for a loop round-trip on every delta.
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self._credits = threading.BoundedSemaphore(capacity)
+        self._terminal = None
+        # Set by the consumer when it stops reading (client disconnected), so
+        # the producer can drop the upstream request and free its slot now
+        # rather than after STREAM_PUT_TIMEOUT.
+        self.closed = threading.Event()
+
+    def _get(self):
+        item = super()._get()
+        if item is not self._terminal:
+            self._credits.release()
+        return item
+
+    def put_threadsafe(self, loop: asyncio.AbstractEventLoop, item) -> None:
+        deadline = time.monotonic() + STREAM_PUT_TIMEOUT
+        while not self.closed.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Wait in short slices so a disconnect is noticed promptly.
+            if self._credits.acquire(timeout=min(remaining, 0.5)):
+                loop.call_soon_threadsafe(self.put_nowait, item)
+                return
+        raise _StreamAbandoned
+
+    def abort_threadsafe(self, loop: asyncio.AbstractEventLoop, item) -> None:
+        """Post a final item without taking a credit.
+
+        Used once the producer gives up, when no credit may ever come back;
+        the consumer still needs a terminal item to close the stream.
+        """
+        self._terminal = item
+        loop.call_soon_threadsafe(self.put_nowait, item)
+
+
+def _start_producer(conversation, query: str, model_id: str) -> _DeltaQueue:
+    """Run ``conversation.ask(stream=True)`` on the worker pool.
+
+    Deltas are posted to the returned queue as ``("delta", text)`` followed by
+    a single ``("done", "")`` or ``("error", message)``. The caller must hold a
+    ``_worker_slots`` permit; the producer releases it when it finishes.
+
+    The queue is bounded, so a slow client throttles the producer instead of
+    buffering the whole answer in memory. If nothing is drained for
+    ``STREAM_PUT_TIMEOUT`` seconds the upstream request is abandoned.
+    """
+    queue = _DeltaQueue(STREAM_QUEUE_SIZE)
     loop = asyncio.get_running_loop()
 
+    def emit(kind: str, payload: str) -> None:
+        queue.put_threadsafe(loop, (kind, payload))
+
     def producer():
-        last = ""
+        # Track how much of the cumulative answer was already sent; snapshots
+        # that do not grow past it (including a shrink) emit nothing.
+        sent = 0
         try:
-            for resp in conversation.ask(query, model=model_id, stream=True):
-                current = resp.answer or ""
-                if len(current) > len(last):
-                    delta = current[len(last) :]
-                    last = current
-                    loop.call_soon_threadsafe(queue.put_nowait, ("delta", delta))
-            loop.call_soon_threadsafe(queue.put_nowait, ("done", ""))
-        except Exception as e:
             try:
-                conversation.ask(query, model=model_id, stream=False)
+                for resp in conversation.ask(query, model=model_id, stream=True):
+                    current = resp.answer or ""
+                    if len(current) > sent:
+                        delta = current[sent:]
+                        sent = len(current)
+                        emit("delta", delta)
+            except _StreamAbandoned:
+                raise
+            except Exception as e:
+                try:
+                    conversation.ask(query, model=model_id, stream=False)
+                except Exception as e2:
+                    emit("error", str(e2) or str(e))
+                    return
                 current = conversation.answer or ""
-                if len(current) > len(last):
-                    loop.call_soon_threadsafe(
-                        queue.put_nowait, ("delta", current[len(last) :])
-                    )
-                loop.call_soon_threadsafe(queue.put_nowait, ("done", ""))
-            except Exception as e2:
-                loop.call_soon_threadsafe(
-                    queue.put_nowait, ("error", str(e2) or str(e))
+                if len(current) > sent:
+                    emit("delta", current[sent:])
+            emit("done", "")
+        except _StreamAbandoned:
+            if queue.closed.is_set():
+                log.info("Stream client disconnected; abandoning upstream request")
+                return
+            log.warning(
+                "Stream consumer stalled for %.0fs; abandoning upstream request",
+                STREAM_PUT_TIMEOUT,
+            )
+            try:
+                queue.abort_threadsafe(
+                    loop, ("error", "stream abandoned: client stopped reading")
                 )
+            except RuntimeError:
+                # Event loop already closed (server shutting down).
+                pass
+        finally:
+            _worker_slots.release()
 
-    threading.Thread(target=producer, daemon=True).start()
+    _worker_pool.submit(producer)
+    return queue
 
-    init_data = {
-        "id": request_id,
-        "object": "chat.completion.chunk",
-        "created": created,
-        "model": model_name,
-        "choices": [
-            {
-                "index": 0,
-                "delta": {"role": "assistant", "content": ""},
-                "finish_reason": None,
-            }
-        ],
-    }
-    yield f"data: {json.dumps(init_data)}\n\n"
 
-    while True:
-        kind, payload = await queue.get()
-        if kind == "delta":
-            chunk_data = {
-                "id": request_id,
-                "object": "chat.completion.chunk",
-                "created": created,
-                "model": model_name,
-                "choices": [
-                    {"index": 0, "delta": {"content": payload}, "finish_reason": None}
-                ],
-            }
-            yield f"data: {json.dumps(chunk_data)}\n\n"
-        elif kind == "error":
-            log.error("Stream error: %s", payload)
-            err_data = {
-                "id": request_id,
-                "object": "chat.completion.chunk",
-                "created": created,
-                "model": model_name,
-                "choices": [{"index": 0, "delta": {}, "finish_reason": "error"}],
-            }
-            yield f"data: {json.dumps(err_data)}\n\n"
-            break
-        else:
-            break
-
-    final_data = {
-        "id": request_id,
-        "object": "chat.completion.chunk",
-        "created": created,
-        "model": model_name,
-        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
-    }
-    yield f"data: {json.dumps(final_data)}\n\n"
-    yield "data: [DONE]\n\n"
+async def _stream_response(
+    queue: _DeltaQueue,
+    model_name: str,
+    request_id: str,
+    created: int,
+):
+    # Every frame shares the id/object/created/model envelope and differs only
+    # in the delta and finish_reason, so the envelope is encoded once per
+    # stream and deltas are spliced in with orjson.
+    head = (
+        b'data: {"id":'
+        + orjson.dumps(request_id)
+        + b',"object":"chat.completion.chunk","created":'
+        + str(created).encode()
+        + b',"model":'
+        + orjson.dumps(model_name)
+        + b',"choices":[{"index":0,"delta":'
+    )
+    delta_prefix = head + b'{"content":'
+    delta_suffix = b'},"finish_reason":null}]}\n\n'
+
+    try:
+        yield head + b'{"role":"assistant","content":""},"finish_reason":null}]}\n\n'
+
+        pending: tuple[str, str] | None = None
+        while True:
+            if pending is not None:
+                kind, payload = pending
+                pending = None
+            else:
+                try:
+                    kind, payload = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try:
+                        async with asyncio.timeout(STREAM_PING_INTERVAL):
+                            kind, payload = await queue.get()
+                    except TimeoutError:
+                        yield _SSE_PING
+                        continue
+            if kind == "delta":
+                # Fold deltas that queued up while we were busy into one frame so
+                # token-granular streams don't cost one SSE frame per token.
+                parts = [payload]
+                size = len(payload)
+                while size < STREAM_COALESCE_MAX:
+                    try:
+                        item = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item[0] != "delta":
+                        pending = item
+                        break
+                    parts.append(item[1])
+                    size += len(item[1])
+                yield delta_prefix + orjson.dumps("".join(parts)) + delta_suffix
+            elif kind == "error":
+                log.error("Stream error: %s", payload)
+                _invalidate_dashboard_token()
+                yield head + b'{},"finish_reason":"error"}]}\n\n'
+                break
+            else:
+                break
+
+        yield head + b'{},"finish_reason":"stop"}]}\n\n'
+        yield b"data: [DONE]\n\n"
+    finally:
+        # Runs on normal completion and when the client disconnects.
+        queue.closed.set()
 
 
 @app.get("/health")
 async def health():
-    dashboard_token = _fetch_session_token_from_dashboard()
+    dashboard_token = _peek_dashboard_token()
     env_token = bool(
         os.environ.get("PERPLEXITY_SESSION_TOKEN")
         or os.environ.get("PERPLEXITY_COOKIES")
@@ -636,7 +949,7 @@ async def health():
         "status": "ok" if has_token else "degraded",
         "version": "2.2.0",
         "engine": "perplexity-webui-scraper",
-        "library_version": _get_installed_version(),
+        "library_version": _INSTALLED_VERSION,
         "token_configured": has_token,
         "source": "dashboard" if dashboard_token else ("env" if env_token else "none"),
         "models_count": len(MODEL_REGISTRY),
@@ -649,7 +962,7 @@ async def root():
         "service": "perplexity-sidecar",
         "version": "2.2.0",
         "engine": "perplexity-webui-scraper",
-        "library_version": _get_installed_version(),
+        "library_version": _INSTALLED_VERSION,
         "endpoints": ["GET /v1/models", "POST /v1/chat/completions", "GET /health"],
     }
 
@@ -658,4 +971,15 @@ if __name__ == "__main__":
     import uvicorn
 
     port = int(os.environ.get("PORT", "8766"))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # uvloop/httptools ship with uvicorn[standard]; request them explicitly so
+    # a missing extra fails loudly instead of silently falling back to asyncio.
+    # Stay single-process: the client, token cache, worker pool and
+    # auto-updater are all per-process state.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+    )